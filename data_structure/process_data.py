@@ -1,25 +1,94 @@
 # 1. IMPORT LIBRARIES
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
 import sqlite3
 
+# Prefer the multi-threaded PyArrow CSV parser, fall back to the C engine
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+if HAS_PYARROW:
+    CSV_READ_OPTIONS = {"engine": "pyarrow", "dtype_backend": "pyarrow"}
+else:
+    CSV_READ_OPTIONS = {"engine": "c"}
+
+# DuckDB runs the merge chain as a single query when installed
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Numba compiles the delivery delay loop when installed
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # Set display options
 pd.set_option('display.max_columns', 50)
 
-print("Libraries imported successfully!")
+print(f"Libraries imported successfully! (CSV engine: {CSV_READ_OPTIONS['engine']}, "
+      f"merge engine: {'duckdb' if duckdb else 'pandas'})")
 
 # 2. LOAD DATASETS
 data_path = ''
 
-customers = pd.read_csv(data_path + "olist_customers_dataset.csv")
-orders = pd.read_csv(data_path + "olist_orders_dataset.csv")
-order_items = pd.read_csv(data_path + "olist_order_items_dataset.csv")
-payments = pd.read_csv(data_path + "olist_order_payments_dataset.csv")
-reviews = pd.read_csv(data_path + "olist_order_reviews_dataset.csv")
-products = pd.read_csv(data_path + "olist_products_dataset.csv")
-sellers = pd.read_csv(data_path + "olist_sellers_dataset.csv")
-geolocation = pd.read_csv(data_path + "olist_geolocation_dataset.csv")
-translation = pd.read_csv(data_path + "product_category_name_translation.csv")
+# Order date columns are parsed during the CSV read itself
+date_cols = [
+    'order_purchase_timestamp', 'order_approved_at',
+    'order_delivered_carrier_date', 'order_delivered_customer_date',
+    'order_estimated_delivery_date'
+]
+
+# Low-cardinality text columns are read as categoricals and null-free
+# counters/zip prefixes as the narrowest integer type that fits
+customers_dtypes = {
+    'customer_zip_code_prefix': 'int32',
+    'customer_city': 'category',
+    'customer_state': 'category'
+}
+orders_dtypes = {'order_status': 'category'}
+order_items_dtypes = {'order_item_id': 'int8'}
+payments_dtypes = {
+    'payment_sequential': 'int8',
+    'payment_type': 'category',
+    'payment_installments': 'int8'
+}
+reviews_dtypes = {'review_score': 'int8'}
+products_dtypes = {
+    'product_category_name': 'category',
+    # Nullable dimensions stay float so the median fill below always fits
+    'product_name_lenght': 'float64',
+    'product_description_lenght': 'float64',
+    'product_photos_qty': 'float64',
+    'product_weight_g': 'float64',
+    'product_length_cm': 'float64',
+    'product_height_cm': 'float64',
+    'product_width_cm': 'float64'
+}
+sellers_dtypes = {
+    'seller_zip_code_prefix': 'int32',
+    'seller_city': 'category',
+    'seller_state': 'category'
+}
+geolocation_dtypes = {
+    'geolocation_zip_code_prefix': 'int32',
+    'geolocation_city': 'category',
+    'geolocation_state': 'category'
+}
+
+customers = pd.read_csv(data_path + "olist_customers_dataset.csv", dtype=customers_dtypes, **CSV_READ_OPTIONS)
+orders = pd.read_csv(data_path + "olist_orders_dataset.csv", dtype=orders_dtypes, parse_dates=date_cols, **CSV_READ_OPTIONS)
+order_items = pd.read_csv(data_path + "olist_order_items_dataset.csv", dtype=order_items_dtypes, **CSV_READ_OPTIONS)
+payments = pd.read_csv(data_path + "olist_order_payments_dataset.csv", dtype=payments_dtypes, **CSV_READ_OPTIONS)
+reviews = pd.read_csv(data_path + "olist_order_reviews_dataset.csv", dtype=reviews_dtypes, **CSV_READ_OPTIONS)
+products = pd.read_csv(data_path + "olist_products_dataset.csv", dtype=products_dtypes, **CSV_READ_OPTIONS)
+sellers = pd.read_csv(data_path + "olist_sellers_dataset.csv", dtype=sellers_dtypes, **CSV_READ_OPTIONS)
+geolocation = pd.read_csv(data_path + "olist_geolocation_dataset.csv", dtype=geolocation_dtypes, **CSV_READ_OPTIONS)
+translation = pd.read_csv(data_path + "product_category_name_translation.csv", **CSV_READ_OPTIONS)
 
 print("All CSVs loaded successfully!")
 print(f"Orders shape: {orders.shape}")
@@ -28,88 +97,156 @@ print(f"Order items shape: {order_items.shape}")
 
 # 3. CLEAN BASIC FORMATS
 
-# Convert date columns to datetime
-date_cols = [
-    'order_purchase_timestamp', 'order_approved_at',
-    'order_delivered_carrier_date', 'order_delivered_customer_date',
-    'order_estimated_delivery_date'
-]
-for col in date_cols:
-    orders[col] = pd.to_datetime(orders[col], errors='coerce')
-
 # Merge product translations (Portuguese to English)
 products = products.merge(translation, on='product_category_name', how='left')
+products['product_category_name_english'] = products['product_category_name_english'].astype('category')
 
-print("Date conversions and product translations complete!")
+print("Product translations complete!")
 
 # 4. MERGE LOGIC
 
-# Step 1: Orders + Customers
-df = pd.merge(orders, customers, on="customer_id", how="left")
-
-# Step 2: Add Order Items
-df = pd.merge(df, order_items, on="order_id", how="left")
-
-# Step 3: Add Products
-df = pd.merge(df, products, on="product_id", how="left")
-
-# Step 4: Add Sellers
-df = pd.merge(df, sellers, on="seller_id", how="left")
-
-# Step 5: Add Payments
-df = pd.merge(df, payments, on="order_id", how="left")
-
-# Step 6: Add Reviews (only review_score)
-df = pd.merge(df, reviews[['order_id', 'review_score']], on="order_id", how="left")
+if duckdb is not None:
+    # One LEFT JOIN chain over the loaded DataFrames: DuckDB plans all six
+    # joins together and materializes only the final result. Joins do not
+    # keep row order, so the ORDER BY keeps the output deterministic
+    merge_sql = """
+        SELECT *
+        FROM orders
+        LEFT JOIN customers USING (customer_id)
+        LEFT JOIN order_items USING (order_id)
+        LEFT JOIN products USING (product_id)
+        LEFT JOIN sellers USING (seller_id)
+        LEFT JOIN payments USING (order_id)
+        LEFT JOIN (SELECT order_id, review_score FROM reviews) AS r USING (order_id)
+        ORDER BY order_id, order_item_id, payment_sequential, review_score
+    """
+    merge_tables = {
+        'orders': orders, 'customers': customers, 'order_items': order_items,
+        'products': products, 'sellers': sellers, 'payments': payments, 'reviews': reviews
+    }
+
+    con = duckdb.connect()
+    for name, table in merge_tables.items():
+        con.register(name, table)
+    df = con.execute(merge_sql).df()
+    con.close()
+
+    # DuckDB returns categoricals as plain strings
+    category_cols = [
+        col for table in merge_tables.values()
+        for col in table.select_dtypes('category').columns if col in df.columns
+    ]
+    df = df.astype({col: 'category' for col in category_cols})
+else:
+    # Index each right-hand table on its join key once and join against the
+    # index instead of re-hashing the key column in every pd.merge
+    customers = customers.set_index('customer_id')
+    order_items = order_items.set_index('order_id')
+    products = products.set_index('product_id')
+    sellers = sellers.set_index('seller_id')
+    payments = payments.set_index('order_id')
+    reviews = reviews[['order_id', 'review_score']].set_index('order_id')
+
+    # Step 1: Orders + Customers
+    df = orders.join(customers, on="customer_id", how="left")
+
+    # Step 2: Add Order Items
+    df = df.join(order_items, on="order_id", how="left")
+
+    # Step 3: Add Products
+    df = df.join(products, on="product_id", how="left")
+
+    # Step 4: Add Sellers
+    df = df.join(sellers, on="seller_id", how="left")
+
+    # Step 5: Add Payments
+    df = df.join(payments, on="order_id", how="left")
+
+    # Step 6: Add Reviews (only review_score)
+    df = df.join(reviews, on="order_id", how="left")
+
+    # One-to-many joins repeat the orders index
+    df = df.reset_index(drop=True)
 
 print(f"Merged dataset shape: {df.shape}")
+print(f"Merged dataset memory: {df.memory_usage(deep=True).sum() / 1024**2:.1f} MB")
 print(f"Columns: {len(df.columns)}")
 
 # 5. HANDLE NULL VALUES
 
 # A. Dates - Keep NaT (meaningful)
-# B. Product categories
-df['product_category_name_english'].fillna('unknown_category', inplace=True)
 
 # Numeric product columns - fill with median
 num_cols = [
     'product_name_lenght', 'product_description_lenght', 'product_photos_qty',
     'product_weight_g', 'product_length_cm', 'product_height_cm', 'product_width_cm'
 ]
-for col in num_cols:
-    df[col].fillna(df[col].median(), inplace=True)
-
-# C. Payments
-df['payment_type'].fillna('unknown', inplace=True)
-df['payment_installments'].fillna(1, inplace=True)
-df['payment_value'].fillna(0, inplace=True)
 
-# D. Review Scores
-df['review_score'].fillna(0, inplace=True)
-
-# E. Sellers
-for col in ['seller_city', 'seller_state']:
-    df[col].fillna('unknown', inplace=True)
-
-# F. Price / Freight
-df['price'].fillna(0, inplace=True)
-df['freight_value'].fillna(0, inplace=True)
+fill_map = {
+    # B. Product categories
+    'product_category_name_english': 'unknown_category',
+    # C. Payments
+    'payment_type': 'unknown',
+    'payment_installments': 1,
+    'payment_value': 0,
+    # D. Review Scores
+    'review_score': 0,
+    # E. Sellers
+    'seller_city': 'unknown',
+    'seller_state': 'unknown',
+    # F. Price / Freight
+    'price': 0,
+    'freight_value': 0
+}
+fill_map.update(df[num_cols].median().to_dict())
+
+# Categorical columns only accept fill values that are existing categories
+for col in df[list(fill_map)].select_dtypes('category').columns:
+    if fill_map[col] not in df[col].cat.categories:
+        df[col] = df[col].cat.add_categories([fill_map[col]])
+
+# Single fill pass over the merged frame
+df = df.fillna(fill_map)
 
 print("Missing values handled successfully!")
 print(f"Remaining nulls: {df.isnull().sum().sum()}")
 
 # 6. FEATURE ENGINEERING
 
-# Delivery delay calculation
-df['delivery_delay_days'] = (
-    (df['order_delivered_customer_date'] - df['order_estimated_delivery_date'])
-    .dt.days
-)
-df['delivery_delay_days'] = df['delivery_delay_days'].fillna(0)
-df['is_delayed'] = (df['delivery_delay_days'] > 0).astype(int)
+# Delivery delay calculation (whole days, 0 when either date is missing)
+if njit is not None:
+    NAT_NS = np.iinfo(np.int64).min
+    NS_PER_DAY = 86_400_000_000_000
+
+    @njit(cache=True)
+    def delay_days(delivered_ns, estimated_ns, out):
+        for i in range(delivered_ns.size):
+            d = delivered_ns[i]
+            e = estimated_ns[i]
+            if d == NAT_NS or e == NAT_NS:
+                out[i] = 0
+            else:
+                # Floor division matches Timedelta.days for early deliveries
+                out[i] = (d - e) // NS_PER_DAY
+
+    # Numba works on raw int64 nanosecond views, not pandas datetime dtypes
+    delivered_ns = df['order_delivered_customer_date'].to_numpy('datetime64[ns]').view('i8')
+    estimated_ns = df['order_estimated_delivery_date'].to_numpy('datetime64[ns]').view('i8')
+    delay = np.empty(len(df), dtype=np.float64)
+    delay_days(delivered_ns, estimated_ns, delay)
+    df['delivery_delay_days'] = delay
+else:
+    df['delivery_delay_days'] = (
+        (df['order_delivered_customer_date'] - df['order_estimated_delivery_date'])
+        .dt.days
+    )
+    df['delivery_delay_days'] = df['delivery_delay_days'].fillna(0)
+
+# Delayed flag - 0/1 flags are stored as int8 (1 byte per row instead of 8)
+df['is_delayed'] = (df['delivery_delay_days'] > 0).astype(np.int8)
 
 # Delivery completed flag
-df['is_delivered'] = df['order_delivered_customer_date'].notnull().astype(int)
+df['is_delivered'] = df['order_delivered_customer_date'].notnull().astype(np.int8)
 
 print("Feature engineering complete!")
 print(f"New columns: delivery_delay_days, is_delayed, is_delivered")
@@ -122,21 +259,61 @@ print(f"Sample columns: {df.columns.tolist()[:10]}")
 
 # 8. SAVE CLEANED OUTPUT
 
-# Save to CSV
-df.to_csv("olist_master_clean.csv", index=False)
-print("Cleaned CSV saved as olist_master_clean.csv")
+# Keep the CSV export for consumers that still read olist_master_clean.csv
+write_csv = True
 
-# Create SQLite database
-engine = create_engine("sqlite:///olist_master_clean.db")
-df.to_sql("olist_master", con=engine, index=False, if_exists="replace")
-print("SQLite database created: olist_master_clean.db")
+# Save to Parquet (columnar, dictionary-encoded, zstd-compressed)
+if HAS_PYARROW:
+    df.to_parquet("olist_master_clean.parquet", engine="pyarrow", compression="zstd", index=False)
+    print("Cleaned Parquet saved as olist_master_clean.parquet")
+else:
+    print("pyarrow not installed, skipping Parquet output")
+
+# Save to CSV
+if write_csv:
+    df.to_csv("olist_master_clean.csv", index=False)
+    print("Cleaned CSV saved as olist_master_clean.csv")
+
+# DuckDB can query the Parquet output in place when both are available
+use_duckdb_view = duckdb is not None and HAS_PYARROW
+
+if use_duckdb_view:
+    # Expose the Parquet file through a DuckDB view instead of copying every
+    # row into a second database. The view stores the relative file name, so
+    # readers set file_search_path to this directory before querying it
+    try:
+        conn = duckdb.connect("olist_master_clean.duckdb")
+        view_target = "olist_master_clean.duckdb"
+    except duckdb.IOException as e:
+        # A running app holds the file open. Its existing view already reads
+        # the Parquet file rewritten above, so only the test query needs a
+        # connection - use an in-memory one with the same view
+        print(f"olist_master_clean.duckdb is in use, keeping its existing view ({e})")
+        conn = duckdb.connect()
+        view_target = "an in-memory database for the test query"
+    conn.execute("""
+        CREATE OR REPLACE VIEW olist_master AS
+        SELECT * FROM read_parquet('olist_master_clean.parquet')
+    """)
+    print(f"DuckDB view created: {view_target}")
+else:
+    # Create SQLite database - bulk load through a plain sqlite3 connection
+    # (executemany per chunk) with journaling relaxed, since the file is
+    # rebuilt from scratch on every run
+    conn = sqlite3.connect("olist_master_clean.db")
+    conn.executescript("""
+        PRAGMA synchronous = OFF;
+        PRAGMA journal_mode = MEMORY;
+        DROP TABLE IF EXISTS olist_master;
+    """)
+    df.to_sql("olist_master", con=conn, index=False, chunksize=10_000)
+    conn.commit()
+    print("SQLite database created: olist_master_clean.db")
 
 print(f"\nFinal dataset shape: {df.shape}")
 print(f"Total records: {len(df)}")
 
 # 9. TEST QUERY
-conn = sqlite3.connect("olist_master_clean.db")
-
 query = """
 SELECT customer_state, ROUND(SUM(price),2) as total_sales
 FROM olist_master
@@ -144,7 +321,11 @@ GROUP BY customer_state
 ORDER BY total_sales DESC
 LIMIT 5;
 """
-result = pd.read_sql(query, conn)
+if use_duckdb_view:
+    result = conn.execute(query).df()
+else:
+    result = pd.read_sql(query, conn)
+conn.close()
 print("\nTop 5 States by Total Sales:")
 print(result)
 
@@ -2,10 +2,12 @@
 
 import os
 import sqlite3
+import threading
 import pandas as pd
 from datetime import datetime
-from typing import TypedDict, Annotated, List, Dict, Any
+from typing import TypedDict, Annotated, List, Dict, Any, Iterator
 from dataclasses import dataclass
+from functools import lru_cache
 import json
 
 from langgraph.graph import StateGraph, END
@@ -13,6 +15,41 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 import re
 
+from migrate_database import sql_dialect_upgrade
+
+# DuckDB serves the olist_master view written by process_data.py when installed
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+# Upper bound on rows fetched for a single query result
+MAX_RESULT_ROWS = 10_000
+
+# Strips a leading ``` fence and/or "sql" tag plus any other ``` fences
+# from LLM output in a single pass
+_SQL_CLEAN_RE = re.compile(r"^(?:```)?\s*(?:sql)?\s*|```\s*", re.IGNORECASE)
+
+
+def _first_statement(text: str):
+    """Return text up to the first top-level ';', or None if not there yet"""
+    depth = 0
+    quote = None
+    for i, ch in enumerate(text):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        elif ch == ';' and depth <= 0:
+            return text[:i + 1]
+    return None
+
 
 @dataclass
 class QueryResult:
@@ -23,6 +60,7 @@ class QueryResult:
     success: bool
     error: str = None
     timestamp: str = None
+    truncated: bool = False
 
 
 class ConversationState(TypedDict):
@@ -35,6 +73,7 @@ class ConversationState(TypedDict):
     session_id: str
     query_count: int
     error: str
+    truncated: bool
 
 
 class LangGraphEcommerceAgent:
@@ -49,7 +88,29 @@ class LangGraphEcommerceAgent:
         
         self.db_path = db_path
         self.history_db_path = history_db
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.is_duckdb = db_path.endswith(".duckdb")
+        self.sql_dialect = "DuckDB" if self.is_duckdb else "SQLite"
+        if self.is_duckdb:
+            if duckdb is None:
+                raise ImportError("duckdb is required to open a .duckdb database")
+            # Read-only so several app sessions can open the file at once; the
+            # view's Parquet path is resolved relative to the database file
+            data_dir = os.path.dirname(os.path.abspath(db_path))
+            self.conn = duckdb.connect(
+                db_path, read_only=True, config={"file_search_path": data_dir}
+            )
+            # The .duckdb file only holds the view; the rows live in the
+            # Parquet file process_data.py writes next to it
+            self.data_files = [db_path, os.path.splitext(db_path)[0] + ".parquet"]
+        else:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.data_files = [db_path]
+        self.history_lock = threading.Lock()
+        
+        # Per-instance memo of query results on (sql, data mtime); kept
+        # off the class so closed agents aren't held alive by a shared cache.
+        # Results are shared between hits, don't mutate them
+        self._cached_query = lru_cache(maxsize=128)(self._query_uncached)
         
         # Initialize LangChain Gemini model
         self.llm = ChatGoogleGenerativeAI(
@@ -60,8 +121,11 @@ class LangGraphEcommerceAgent:
             top_k=40,
         )
         
-        # Load database schema
+        # Load database schema and the prompt text built from it, once
         self.schema = self._get_schema()
+        self._schema_text = "\n".join(
+            f"Table: {t}\nColumns: {', '.join(c)}" for t, c in self.schema.items()
+        )
         
         # Initialize chat history storage
         self._init_history_db()
@@ -74,19 +138,45 @@ class LangGraphEcommerceAgent:
     def _get_schema(self) -> Dict[str, List[str]]:
         """Get database schema"""
         schema = {}
+        if self.is_duckdb:
+            # Views such as olist_master are listed alongside base tables
+            rows = self.conn.execute("""
+                SELECT table_name, column_name
+                FROM information_schema.columns
+                ORDER BY table_name, ordinal_position
+            """).fetchall()
+            for table, column in rows:
+                schema.setdefault(table, []).append(column)
+            return schema
+        
         tables_query = "SELECT name FROM sqlite_master WHERE type='table';"
-        tables = pd.read_sql(tables_query, self.conn)['name'].tolist()
+        tables = [row[0] for row in self.conn.execute(tables_query).fetchall()]
         
         for table in tables:
-            cols = pd.read_sql(f"PRAGMA table_info({table});", self.conn)
-            schema[table] = cols['name'].tolist()
+            cols = self.conn.execute(f"PRAGMA table_info({table});").fetchall()
+            schema[table] = [col[1] for col in cols]
         
         return schema
     
     def _init_history_db(self):
         """Initialize SQLite database for chat history"""
-        history_conn = sqlite3.connect(self.history_db_path)
-        cursor = history_conn.cursor()
+        # One long-lived connection shared by all history methods, guarded by
+        # history_lock since Streamlit may call in from different threads.
+        # Autocommit mode: writes open their own BEGIN IMMEDIATE transaction
+        self.history_conn = sqlite3.connect(
+            self.history_db_path, check_same_thread=False, isolation_level=None
+        )
+        self.history_conn.row_factory = sqlite3.Row
+        cursor = self.history_conn.cursor()
+        
+        # WAL persists on the file; synchronous is per connection. Under WAL,
+        # NORMAL syncs only at checkpoints, so a crash can at worst lose the
+        # last message rather than corrupt the history
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-65536")
         
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS chat_sessions (
@@ -106,13 +196,28 @@ class LangGraphEcommerceAgent:
                 sql_query TEXT,
                 result_count INTEGER,
                 success BOOLEAN,
+                sql_dialect TEXT,
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (session_id) REFERENCES chat_sessions(session_id)
             )
         """)
         
-        history_conn.commit()
-        history_conn.close()
+        # Older history files predate sql_dialect; apply the same upgrade
+        # migrate_database.py runs so the app works before it is migrated
+        add_sql_dialect = sql_dialect_upgrade(cursor)
+        if add_sql_dialect:
+            cursor.execute(add_sql_dialect)
+        
+        # Indexes for per-session message lookups and the recent sessions list
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_msgs_session_time
+            ON chat_messages(session_id, timestamp)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_activity
+            ON chat_sessions(last_activity DESC)
+        """)
+        
         print(f"Chat history database initialized: {self.history_db_path}")
     
     def _build_graph(self) -> StateGraph:
@@ -187,11 +292,6 @@ class LangGraphEcommerceAgent:
         messages = state["messages"]
         user_query = messages[-1].content
         
-        # Build schema text
-        schema_text = "\n".join(
-            [f"Table: {t}\nColumns: {', '.join(c)}" for t, c in state["database_schema"].items()]
-        )
-        
         # Build conversation context with previous SQL queries
         context_text = ""
         if len(messages) > 1:
@@ -209,14 +309,14 @@ class LangGraphEcommerceAgent:
                 context_text += "\nIMPORTANT: If the user's question refers to 'those', 'that', 'them', 'these results', use the context above to understand what they're referring to.\n"
         
         # Create prompt with context
-        prompt_text = f"""You are an expert SQL generator for SQLite databases with conversational awareness.
+        prompt_text = f"""You are an expert SQL generator for {self.sql_dialect} databases with conversational awareness.
 
 Database Schema:
-{schema_text}
+{self._schema_text}
 {context_text}
 
 CRITICAL RULES:
-1. Output ONLY a valid SQLite SELECT statement
+1. Output ONLY a valid {self.sql_dialect} SELECT statement
 2. Do NOT include markdown, backticks, or explanations
 3. Use only tables and columns from the schema above
 4. The main table is 'olist_master' (use this table for all queries)
@@ -231,14 +331,19 @@ Current User Question: "{user_query}"
 Generate ONLY the SQL query:"""
         
         try:
-            # Call LLM with HumanMessage (Gemini requires at least one non-system message)
-            response = self.llm.invoke([HumanMessage(content=prompt_text)])
-            sql = response.content.strip()
+            # Stream the LLM response (Gemini requires at least one non-system
+            # message) and stop as soon as the first statement is complete
+            chunks = []
+            statement = None
+            for chunk in self.llm.stream([HumanMessage(content=prompt_text)]):
+                chunks.append(chunk.content)
+                if ";" in chunk.content:
+                    statement = _first_statement("".join(chunks))
+                    if statement:
+                        break
             
             # Clean the SQL
-            sql = re.sub(r'```sql\s*', '', sql)
-            sql = re.sub(r'```\s*', '', sql)
-            sql = re.sub(r'^sql\s*', '', sql, flags=re.IGNORECASE)
+            sql = _SQL_CLEAN_RE.sub('', (statement or "".join(chunks)).strip())
             sql = sql.strip().rstrip(';').strip()
             sql = ' '.join(sql.split())
             
@@ -258,8 +363,11 @@ Generate ONLY the SQL query:"""
             return state
         
         try:
-            result_df = pd.read_sql(sql, self.conn)
+            # Repeated questions often regenerate the same SQL; the data
+            # mtime in the key invalidates cached results when the files change
+            result_df = self._cached_query(sql, self._data_mtime())
             state["last_result"] = result_df
+            state["truncated"] = result_df.attrs.get("truncated", False)
             state["query_count"] = state.get("query_count", 0) + 1
             
         except Exception as e:
@@ -283,6 +391,11 @@ Generate ONLY the SQL query:"""
         elif row_count == 1 and len(result_df.columns) == 1:
             value = result_df.iloc[0, 0]
             response_text = f"The answer is: {value}"
+        elif state.get("truncated"):
+            response_text = (
+                f"Your query returned more than {MAX_RESULT_ROWS:,} rows; "
+                f"showing the first {MAX_RESULT_ROWS:,}."
+            )
         else:
             response_text = f"I found {row_count} results for your query."
         
@@ -330,6 +443,32 @@ Generate ONLY the SQL query:"""
     
     # Helper Methods
     
+    def run_query(self, sql: str) -> pd.DataFrame:
+        """Run a query, keeping at most MAX_RESULT_ROWS rows; attrs["truncated"] marks a cut-off result"""
+        # A DuckDB cursor is its own connection, so concurrent sessions don't
+        # share result state; for sqlite3 this is an ordinary cursor
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql)
+            columns = [col[0] for col in cursor.description]
+            # One extra row tells a capped result apart from an exact fit
+            rows = cursor.fetchmany(MAX_RESULT_ROWS + 1)
+        finally:
+            cursor.close()
+        
+        truncated = len(rows) > MAX_RESULT_ROWS
+        df = pd.DataFrame.from_records(rows[:MAX_RESULT_ROWS], columns=columns, coerce_float=True)
+        df.attrs["truncated"] = truncated
+        return df
+    
+    def _data_mtime(self) -> float:
+        """Latest modification time across the files backing the database"""
+        return max(os.path.getmtime(path) for path in self.data_files if os.path.exists(path))
+    
+    def _query_uncached(self, sql: str, mtime: float) -> pd.DataFrame:
+        """run_query keyed on (sql, data mtime), wrapped by _cached_query"""
+        return self.run_query(sql)
+    
     def _build_context(self, messages: List) -> str:
         """Build context from previous messages"""
         if not messages:
@@ -358,58 +497,63 @@ Generate ONLY the SQL query:"""
     def save_message(self, session_id: str, role: str, content: str, 
                     sql: str = None, result_count: int = 0, success: bool = True):
         """Save message to persistent history"""
-        history_conn = sqlite3.connect(self.history_db_path)
-        cursor = history_conn.cursor()
-        
-        # Check if session exists
-        cursor.execute("SELECT session_name FROM chat_sessions WHERE session_id = ?", (session_id,))
-        existing = cursor.fetchone()
-        
-        if not existing:
-            # New session - generate name from first user message
-            session_name = self._generate_session_name(content) if role == 'user' else "New Chat"
-            cursor.execute("""
-                INSERT INTO chat_sessions (session_id, session_name) 
-                VALUES (?, ?)
-            """, (session_id, session_name))
-        
-        # Update last activity
-        cursor.execute("""
-            UPDATE chat_sessions 
-            SET last_activity = CURRENT_TIMESTAMP 
-            WHERE session_id = ?
-        """, (session_id,))
-        
-        # Insert message
-        cursor.execute("""
-            INSERT INTO chat_messages 
-            (session_id, role, content, sql_query, result_count, success)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (session_id, role, content, sql, result_count, success))
-        
-        history_conn.commit()
-        history_conn.close()
+        self.save_messages(session_id, [(role, content, sql, result_count, success)])
+    
+    def save_messages(self, session_id: str, rows: List[tuple]):
+        """Save (role, content, sql, result_count, success) rows in one transaction"""
+        if not rows:
+            return
+        
+        # New session - generate name from first user message
+        first_role, first_content = rows[0][0], rows[0][1]
+        session_name = self._generate_session_name(first_content) if first_role == 'user' else "New Chat"
+        
+        with self.history_lock:
+            cursor = self.history_conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # Create the session if it doesn't exist yet
+                cursor.execute("""
+                    INSERT OR IGNORE INTO chat_sessions (session_id, session_name) 
+                    VALUES (?, ?)
+                """, (session_id, session_name))
+                
+                # Update last activity
+                cursor.execute("""
+                    UPDATE chat_sessions 
+                    SET last_activity = CURRENT_TIMESTAMP 
+                    WHERE session_id = ?
+                """, (session_id,))
+                
+                # Insert messages, tagging SQL with the dialect it was written for
+                cursor.executemany("""
+                    INSERT INTO chat_messages 
+                    (session_id, role, content, sql_query, result_count, success, sql_dialect)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, [(session_id, *row, self.sql_dialect if row[2] else None) for row in rows])
+                
+                cursor.execute("COMMIT")
+            except Exception:
+                self.history_conn.rollback()
+                raise
     
     def load_session_history(self, session_id: str) -> List[Dict]:
         """Load chat history for a session"""
-        history_conn = sqlite3.connect(self.history_db_path)
-        
         query = """
-            SELECT role, content, sql_query, result_count, success, timestamp
+            SELECT role, content, sql_query, result_count, success,
+                   COALESCE(sql_dialect, 'SQLite') AS sql_dialect, timestamp
             FROM chat_messages
             WHERE session_id = ?
-            ORDER BY timestamp ASC
+            ORDER BY timestamp ASC, id ASC
         """
         
-        history_df = pd.read_sql(query, history_conn, params=(session_id,))
-        history_conn.close()
+        with self.history_lock:
+            rows = self.history_conn.execute(query, (session_id,)).fetchall()
         
-        return history_df.to_dict('records')
+        return [dict(row) for row in rows]
     
     def get_recent_context_from_db(self, session_id: str, limit: int = 10) -> List:
         """Load recent messages from database to restore context"""
-        from langchain_core.messages import HumanMessage, AIMessage
-        
         history = self.load_session_history(session_id)
         messages = []
         
@@ -422,44 +566,60 @@ Generate ONLY the SQL query:"""
         
         return messages
     
-    def get_all_sessions(self) -> List[Dict]:
-        """Get all chat sessions with names"""
-        history_conn = sqlite3.connect(self.history_db_path)
-        
+    def get_all_sessions(self, limit: int = None) -> List[Dict]:
+        """Get chat sessions with names and message counts, most recent first"""
+        # Counts come from one GROUP BY over the session/time index, joined
+        # back to the sessions, so the whole list is a single query
         query = """
-            SELECT session_id, session_name, created_at, last_activity,
-                   (SELECT COUNT(*) FROM chat_messages WHERE session_id = s.session_id) as message_count
+            SELECT s.session_id, s.session_name, s.created_at, s.last_activity,
+                   COALESCE(c.n, 0) AS message_count
             FROM chat_sessions s
-            ORDER BY last_activity DESC
+            LEFT JOIN (
+                SELECT session_id, COUNT(*) AS n
+                FROM chat_messages
+                GROUP BY session_id
+            ) c USING (session_id)
+            ORDER BY s.last_activity DESC
+            LIMIT ?
         """
         
-        sessions_df = pd.read_sql(query, history_conn)
-        history_conn.close()
+        # SQLite treats a negative LIMIT as no limit
+        with self.history_lock:
+            rows = self.history_conn.execute(query, (-1 if limit is None else limit,)).fetchall()
         
-        return sessions_df.to_dict('records')
+        return [dict(row) for row in rows]
     
     def delete_session(self, session_id: str) -> bool:
         """Delete a session and all its messages"""
-        try:
-            history_conn = sqlite3.connect(self.history_db_path)
-            cursor = history_conn.cursor()
-            
-            # Delete all messages in the session
-            cursor.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
-            
-            # Delete the session itself
-            cursor.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
-            
-            history_conn.commit()
-            history_conn.close()
-            return True
-        except Exception as e:
-            print(f"Error deleting session: {e}")
-            return False
+        with self.history_lock:
+            try:
+                cursor = self.history_conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                
+                # Delete all messages in the session
+                cursor.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+                
+                # Delete the session itself
+                cursor.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+                
+                cursor.execute("COMMIT")
+                return True
+            except Exception as e:
+                self.history_conn.rollback()
+                print(f"Error deleting session: {e}")
+                return False
     
     def process_message(self, user_message: str, session_id: str, 
                        existing_messages: List = None) -> QueryResult:
         """Process a user message through the LangGraph workflow"""
+        for update in self.process_message_stream(user_message, session_id, existing_messages):
+            result = update
+        return result
+    
+    def process_message_stream(self, user_message: str, session_id: str,
+                               existing_messages: List = None) -> Iterator:
+        """Like process_message, but yield each graph node's name as it finishes
+        and the QueryResult last"""
         
         # Initialize state - use existing messages or load from database
         if existing_messages:
@@ -478,11 +638,29 @@ Generate ONLY the SQL query:"""
             last_result=None,
             session_id=session_id,
             query_count=0,
-            error=""
+            error="",
+            truncated=False
         )
         
-        # Run the graph
-        final_state = self.graph.invoke(initial_state)
+        # Run the graph, reporting progress after every node
+        final_state = dict(initial_state)
+        finished = False
+        try:
+            for update in self.graph.stream(initial_state, stream_mode="updates"):
+                for node, output in update.items():
+                    if output:
+                        final_state.update(output)
+                    yield node
+            finished = True
+        finally:
+            # The caller may drop the generator mid-run (a Streamlit rerun) or
+            # a node may raise; the turn is still saved, marked as failed
+            if not finished:
+                error = final_state.get("error") or "Interrupted before the workflow finished"
+                self.save_messages(session_id, [
+                    ("user", user_message, None, 0, True),
+                    ("assistant", error, final_state.get("last_sql", ""), 0, False)
+                ])
         
         # Extract results
         success = not bool(final_state.get("error"))
@@ -490,45 +668,32 @@ Generate ONLY the SQL query:"""
         data = final_state.get("last_result")
         error = final_state.get("error", "")
         
-        # Save to history
-        self.save_message(
-            session_id=session_id,
-            role="user",
-            content=user_message,
-            success=True
-        )
-        
+        # Save the user message and the assistant reply together
         if success and data is not None:
-            result_count = len(data)
-            self.save_message(
-                session_id=session_id,
-                role="assistant",
-                content=final_state["messages"][-1].content,
-                sql=sql,
-                result_count=result_count,
-                success=True
-            )
+            assistant_row = ("assistant", final_state["messages"][-1].content, sql, len(data), True)
         else:
-            self.save_message(
-                session_id=session_id,
-                role="assistant",
-                content=error,
-                sql=sql,
-                result_count=0,
-                success=False
-            )
+            assistant_row = ("assistant", error, sql, 0, False)
+        
+        self.save_messages(session_id, [
+            ("user", user_message, None, 0, True),
+            assistant_row
+        ])
         
         # Return result
-        return QueryResult(
+        yield QueryResult(
             question=user_message,
             sql=sql,
             data=data if data is not None else pd.DataFrame(),
             success=success,
             error=error if not success else None,
-            timestamp=datetime.now().isoformat()
+            timestamp=datetime.now().isoformat(),
+            truncated=bool(final_state.get("truncated"))
         )
     
     def close(self):
         """Close database connections"""
+        self._cached_query.cache_clear()
         if self.conn:
             self.conn.close()
+        if self.history_conn:
+            self.history_conn.close()
@@ -1,14 +1,17 @@
 import streamlit as st
-import pandas as pd
 import os
 from dotenv import load_dotenv
-from langgraph_agent import LangGraphEcommerceAgent
+from langgraph_agent import LangGraphEcommerceAgent, QueryResult, MAX_RESULT_ROWS
+from langchain_core.messages import HumanMessage, AIMessage
 from datetime import datetime
 import uuid
 
 # Load environment variables
 load_dotenv()
 
+# Number of most recent chat messages rendered on each rerun
+VISIBLE_TAIL = 20
+
 # Page configuration
 st.set_page_config(
     page_title="E-commerce AI Assistant (LangGraph)",
@@ -17,8 +20,7 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS
-st.markdown("""
+CUSTOM_CSS = """
 <style>
     .main-title {
         font-size: 2.5rem;
@@ -67,8 +69,24 @@ st.markdown("""
         border-radius: 0.5rem;
         margin-bottom: 1rem;
     }
+    .stButton > button {
+        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+        color: white;
+        font-weight: 600;
+        border: none;
+        border-radius: 8px;
+        padding: 0.6rem 1.2rem;
+        transition: all 0.3s ease;
+    }
+    .stButton > button:hover {
+        transform: translateY(-2px);
+        box-shadow: 0 6px 20px rgba(102, 126, 234, 0.4);
+    }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Custom CSS - one style element for the whole page
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 # Initialize session state
 if 'agent' not in st.session_state:
@@ -81,6 +99,61 @@ if 'langgraph_messages' not in st.session_state:
     st.session_state.langgraph_messages = []
 if 'initialized' not in st.session_state:
     st.session_state.initialized = False
+if 'sessions_version' not in st.session_state:
+    st.session_state.sessions_version = 0
+if 'visible_extra' not in st.session_state:
+    st.session_state.visible_extra = 0
+if 'user_msg_count' not in st.session_state:
+    st.session_state.user_msg_count = 0
+
+
+def _resolve_db_path():
+    """(configured, absolute) data DB path; prefers the DuckDB view if it exists"""
+    default_db = "../data_structure/olist_master_clean.duckdb"
+    if not os.path.exists(os.path.join(os.path.dirname(__file__), default_db)):
+        default_db = "../data_structure/olist_master_clean.db"
+    db_path = os.getenv("DB_PATH", default_db)
+    return db_path, os.path.join(os.path.dirname(__file__), db_path)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_sessions(version: int, agent_id: int, _agent):
+    """Recent sessions for the sidebar; version is bumped whenever they change"""
+    sessions = _agent.get_all_sessions(limit=10)
+    
+    # Format timestamps here so cached reruns don't parse them again
+    for session in sessions:
+        try:
+            last_active = datetime.fromisoformat(session['last_activity'])
+            session['time_str'] = last_active.strftime("%b %d, %I:%M %p")
+        except (TypeError, ValueError):
+            session['time_str'] = "Recently"
+    return sessions
+
+
+@st.cache_data(show_spinner=False)
+def _schema_markdown(schema: tuple) -> str:
+    """Schema expander body as one markdown string, from ((table, columns), ...)"""
+    return "\n\n".join(f"**{table}**\n\n{', '.join(columns)}" for table, columns in schema)
+
+
+@st.dialog("Delete conversation?")
+def _confirm_delete(session_id: str, session_name: str):
+    """Confirm and delete a session; only a resolved dialog reruns the page"""
+    st.markdown(f"**{session_name}** and all its messages will be deleted.")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Delete", type="primary", use_container_width=True):
+            if st.session_state.agent.delete_session(session_id):
+                st.session_state.sessions_version += 1
+                st.toast(f"Deleted: {session_name}", icon="✅")
+            else:
+                st.toast("Failed to delete session", icon="❌")
+            st.rerun()
+    with col2:
+        if st.button("Cancel", use_container_width=True):
+            st.rerun()
+
 
 # Sidebar
 with st.sidebar:
@@ -88,7 +161,12 @@ with st.sidebar:
     
     # API key and DB path
     api_key = os.getenv("GEMINI_API_KEY")
-    db_path = os.getenv("DB_PATH", "../data_structure/olist_master_clean.db")
+    # Re-resolved until the agent starts, so a database generated after the
+    # page loaded is picked up; afterwards the path the agent opened is kept
+    if st.session_state.initialized:
+        db_path = st.session_state.db_path
+    else:
+        db_path, full_db_path = _resolve_db_path()
     
     if api_key:
         st.success("✓ API Key loaded")
@@ -103,8 +181,6 @@ with st.sidebar:
             if not api_key:
                 st.error("Please set GEMINI_API_KEY in .env")
             else:
-                full_db_path = os.path.join(os.path.dirname(__file__), db_path)
-                
                 if not os.path.exists(full_db_path):
                     st.error(f"Database not found: {full_db_path}")
                 else:
@@ -116,6 +192,7 @@ with st.sidebar:
                                 history_db="chat_history.db"
                             )
                             st.session_state.initialized = True
+                            st.session_state.db_path = db_path
                             
                             # Add welcome message
                             welcome_msg = """
@@ -137,33 +214,13 @@ with st.sidebar:
         # Show session info with context indicator
         session_info = f"📝 Session: {st.session_state.session_id[:8]}..."
         if len(st.session_state.messages) > 0:
-            msg_count = len([m for m in st.session_state.messages if m['role'] == 'user'])
-            session_info += f" | 💬 {msg_count} questions in context"
+            session_info += f" | 💬 {st.session_state.user_msg_count} questions in context"
         st.info(session_info)
         
         # Session management
         st.divider()
         st.markdown("###  Session Management")
         
-        # Enhanced new chat button styling
-        st.markdown("""
-            <style>
-            .stButton > button {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                font-weight: 600;
-                border: none;
-                border-radius: 8px;
-                padding: 0.6rem 1.2rem;
-                transition: all 0.3s ease;
-            }
-            .stButton > button:hover {
-                transform: translateY(-2px);
-                box-shadow: 0 6px 20px rgba(102, 126, 234, 0.4);
-            }
-            </style>
-        """, unsafe_allow_html=True)
-        
         col1, col2 = st.columns(2)
         
         with col1:
@@ -171,6 +228,9 @@ with st.sidebar:
                 st.session_state.session_id = str(uuid.uuid4())
                 st.session_state.messages = []
                 st.session_state.langgraph_messages = []
+                st.session_state.visible_extra = 0
+                st.session_state.user_msg_count = 0
+                st.session_state.sessions_version += 1
                 st.rerun()
         
         # with col2:
@@ -184,42 +244,48 @@ with st.sidebar:
             st.divider()
             st.markdown("### 💬 Recent Conversations")
             
-            sessions = st.session_state.agent.get_all_sessions()
+            sessions = _cached_sessions(
+                st.session_state.sessions_version,
+                id(st.session_state.agent),
+                st.session_state.agent
+            )
             if sessions:
-                for session in sessions[:10]:
+                # Build every session card into one HTML block so the
+                # sidebar sends a single markdown element per rerun
+                html_parts = []
+                session_names = []
+                for n, session in enumerate(sessions, 1):
                     session_name = session.get('session_name', 'Untitled Chat')
                     if not session_name or session_name == 'None':
                         session_name = 'Untitled Chat'
+                    session_names.append(session_name)
                     
-                    # Format timestamp
-                    from datetime import datetime
-                    try:
-                        last_active = datetime.fromisoformat(session['last_activity'])
-                        time_str = last_active.strftime("%b %d, %I:%M %p")
-                    except:
-                        time_str = "Recently"
-                    
-                    # Create session card with load and delete buttons
-                    col1, col2, col3 = st.columns([5, 1, 1])
-                    with col1:
-                        st.markdown(f"""
-                        <div class="session-card">
-                            <div class="session-title">💬 {session_name}</div>
-                            <div class="session-meta">
-                                <span>📅 {time_str}</span>
-                                <span>💬 {session['message_count']} msgs</span>
-                            </div>
+                    html_parts.append(f"""
+                    <div class="session-card">
+                        <div class="session-title">{n}. 💬 {session_name}</div>
+                        <div class="session-meta">
+                            <span>📅 {session['time_str']}</span>
+                            <span>💬 {session['message_count']} msgs</span>
                         </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with col2:
-                        if st.button("📂", key=f"load_{session['session_id']}", help="Load this conversation"):
+                    </div>
+                    """)
+                st.markdown("".join(html_parts), unsafe_allow_html=True)
+                
+                # Numbered load and delete buttons matching the cards above
+                for n, (session, session_name) in enumerate(zip(sessions, session_names), 1):
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        if st.button(f"📂 {n}", key=f"load_{session['session_id']}", help="Load this conversation"):
                             st.session_state.session_id = session['session_id']
                             # Load messages
                             history = st.session_state.agent.load_session_history(session['session_id'])
                             
-                            # Restore display messages with re-execution of SQL queries
-                            st.session_state.messages = []
+                            # Restore display messages and LangGraph context
+                            # memory in one pass; result tables are re-run only
+                            # when the user asks for them
+                            messages = []
+                            langgraph_messages = []
+                            msg_count = 0
                             for msg in history:
                                 message_dict = {
                                     "role": msg['role'],
@@ -228,50 +294,35 @@ with st.sidebar:
                                     "timestamp": msg['timestamp']
                                 }
                                 
-                                # Re-execute SQL queries to restore data
-                                if msg['role'] == 'assistant' and msg.get('sql_query'):
-                                    try:
-                                        # Re-run the SQL to get the data
-                                        import pandas as pd
-                                        data = pd.read_sql(msg['sql_query'], st.session_state.agent.conn)
-                                        message_dict['data'] = data
-                                    except:
-                                        # If query fails, just show message without data
+                                if msg['role'] == 'user':
+                                    msg_count += 1
+                                    langgraph_messages.append(HumanMessage(content=msg['content']))
+                                elif msg['role'] == 'assistant':
+                                    langgraph_messages.append(AIMessage(content=msg['content']))
+                                    if msg.get('sql_query') and msg['success']:
                                         message_dict['data'] = None
+                                        message_dict['lazy'] = True
+                                        message_dict['sql_dialect'] = msg['sql_dialect']
                                 
-                                st.session_state.messages.append(message_dict)
+                                messages.append(message_dict)
                             
-                            # Restore LangGraph messages for context memory
-                            from langchain_core.messages import HumanMessage, AIMessage
-                            st.session_state.langgraph_messages = []
-                            for msg in history:
-                                if msg['role'] == 'user':
-                                    st.session_state.langgraph_messages.append(
-                                        HumanMessage(content=msg['content'])
-                                    )
-                                elif msg['role'] == 'assistant':
-                                    st.session_state.langgraph_messages.append(
-                                        AIMessage(content=msg['content'])
-                                    )
+                            st.session_state.messages = messages
+                            st.session_state.langgraph_messages = langgraph_messages
+                            st.session_state.visible_extra = 0
+                            st.session_state.user_msg_count = msg_count
                             
                             # Show success message
-                            msg_count = len([m for m in history if m['role'] == 'user'])
                             st.success(f"✓ Loaded session with {msg_count} questions. Context restored!")
                             st.rerun()
                     
-                    with col3:
-                        # Simple delete button
-                        if st.button("🗑️", key=f"delete_{session['session_id']}", help="Delete this conversation", type="secondary"):
+                    with col2:
+                        # Delete button - confirmation runs in a dialog
+                        if st.button(f"🗑️ {n}", key=f"delete_{session['session_id']}", help="Delete this conversation", type="secondary"):
                             # Check if it's the current session
                             if session['session_id'] == st.session_state.session_id:
                                 st.toast("⚠️ Can't delete active session. Start a new chat first.", icon="⚠️")
                             else:
-                                # Delete the session
-                                if st.session_state.agent.delete_session(session['session_id']):
-                                    st.toast(f"Deleted: {session_name}", icon="✅")
-                                    st.rerun()
-                                else:
-                                    st.toast("Failed to delete session", icon="❌")
+                                _confirm_delete(session['session_id'], session_name)
             else:
                 st.info("💭 No previous conversations yet. Start chatting to create your first session!")
         
@@ -279,8 +330,7 @@ with st.sidebar:
         if len(st.session_state.messages) > 0:
             st.divider()
             st.markdown("###  Current Session Stats")
-            user_msgs = sum(1 for m in st.session_state.messages if m['role'] == 'user')
-            st.metric("Questions Asked", user_msgs)
+            st.metric("Questions Asked", st.session_state.user_msg_count)
     
     # Sample questions
     st.divider()
@@ -294,19 +344,23 @@ with st.sidebar:
         "Revenue by month?",
     ]
     
+    # A click already reruns the script, so the question is answered further
+    # down in this same run rather than after another st.rerun()
+    sample_question = None
     for sq in samples:
         if st.button(sq, key=f"sample_{sq}", use_container_width=True):
             if st.session_state.initialized:
-                st.session_state.pending_question = sq
-                st.rerun()
+                sample_question = sq
     
     # Schema viewer
     if st.session_state.agent:
         st.divider()
         with st.expander("Database Schema"):
-            for table, columns in st.session_state.agent.schema.items():
-                st.markdown(f"**{table}**")
-                st.text(", ".join(columns))
+            schema = tuple(
+                (table, tuple(columns))
+                for table, columns in st.session_state.agent.schema.items()
+            )
+            st.markdown(_schema_markdown(schema))
 
 # Main chat interface
 st.markdown('<div class="main-title"> E-commerce AI Assistant</div>', unsafe_allow_html=True)
@@ -321,8 +375,17 @@ if not st.session_state.initialized:
     
     """)
 else:
-    # Display chat messages
-    for message in st.session_state.messages:
+    # Display chat messages - only the most recent ones, older history is
+    # revealed in VISIBLE_TAIL-sized steps
+    messages = st.session_state.messages
+    hidden = max(0, len(messages) - VISIBLE_TAIL - st.session_state.visible_extra)
+    if hidden:
+        if st.button(f"Load {min(hidden, VISIBLE_TAIL)} earlier messages"):
+            st.session_state.visible_extra += VISIBLE_TAIL
+            st.rerun()
+    
+    for i in range(hidden, len(messages)):
+        message = messages[i]
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
             
@@ -331,25 +394,44 @@ else:
                 with st.expander(" SQL Query"):
                     st.code(message["sql"], language="sql")
                 
+                # Messages restored from history re-run their SQL on demand,
+                # but only against the kind of database it was written for
+                if message.get("lazy") and message.get("data") is None:
+                    if message["sql_dialect"] != st.session_state.agent.sql_dialect:
+                        st.caption(
+                            f"Results unavailable: this query was written for "
+                            f"{message['sql_dialect']}, the current database is "
+                            f"{st.session_state.agent.sql_dialect}."
+                        )
+                    elif st.button("Show results", key=f"show_{i}"):
+                        try:
+                            message["data"] = st.session_state.agent.run_query(message["sql"])
+                        except Exception as e:
+                            st.error(f"Could not re-run query: {e}")
+                
                 if message.get("data") is not None:
                     data = message["data"]
                     if len(data) > 0:
                         st.dataframe(data, use_container_width=True)
                         
-                        # Download button
-                        csv = data.to_csv(index=False)
-                        st.download_button(
-                            label=" Download CSV",
-                            data=csv,
-                            file_name=f"results_{message['timestamp']}.csv",
-                            mime="text/csv",
-                            key=f"download_{message['timestamp']}"
-                        )
+                        # Download button - CSV is only encoded and sent
+                        # once the user asks for it; the bytes are kept on
+                        # the message so they live and die with the session
+                        if message.get("csv") is None:
+                            if st.button(" Prepare CSV", key=f"csv_{i}"):
+                                message["csv"] = data.to_csv(index=False).encode("utf-8")
+                        if message.get("csv") is not None:
+                            st.download_button(
+                                label=" Download CSV",
+                                data=message["csv"],
+                                file_name=f"results_{message['timestamp']}.csv",
+                                mime="text/csv",
+                                key=f"download_{message['timestamp']}"
+                            )
     
-    # Handle pending question from sample buttons
-    if hasattr(st.session_state, 'pending_question'):
-        prompt = st.session_state.pending_question
-        delattr(st.session_state, 'pending_question')
+    # Handle a question from the sample buttons in this run
+    if sample_question:
+        prompt = sample_question
     else:
         prompt = st.chat_input("Ask me anything about your e-commerce data...")
     
@@ -364,74 +446,91 @@ else:
             "content": prompt,
             "timestamp": datetime.now().isoformat()
         })
+        st.session_state.user_msg_count += 1
         
         # Process through LangGraph
         with st.chat_message("assistant"):
-            with st.spinner("Processing through LangGraph workflow..."):
-                result = st.session_state.agent.process_message(
+            # The turn is saved even if this run is interrupted, so the
+            # sidebar's session list is stale either way
+            st.session_state.sessions_version += 1
+            
+            # Show each workflow step as LangGraph finishes it
+            with st.status("Processing through LangGraph workflow...") as status:
+                for update in st.session_state.agent.process_message_stream(
                     user_message=prompt,
                     session_id=st.session_state.session_id,
                     existing_messages=st.session_state.langgraph_messages
-                )
-                
-                # Update LangGraph message history
-                from langchain_core.messages import HumanMessage, AIMessage
-                st.session_state.langgraph_messages.append(HumanMessage(content=prompt))
-                
-                if result.success:
-                    row_count = len(result.data)
-                    
-                    if row_count == 0:
-                        response_text = "I found no results for your query."
-                    elif row_count == 1 and len(result.data.columns) == 1:
-                        value = result.data.iloc[0, 0]
-                        response_text = f"**Answer:** {value}"
+                ):
+                    if isinstance(update, QueryResult):
+                        result = update
                     else:
-                        response_text = f"Found **{row_count}** results:"
-                    
-                    st.markdown(response_text)
-                    st.session_state.langgraph_messages.append(AIMessage(content=response_text))
-                    
-                    # Show SQL
-                    if result.sql:
-                        with st.expander("SQL Query"):
-                            st.code(result.sql, language="sql")
-                    
-                    # Show results
-                    if row_count > 0:
-                        st.dataframe(result.data, use_container_width=True)
-                        
-                        csv = result.data.to_csv(index=False)
-                        st.download_button(
-                            label=" Download CSV",
-                            data=csv,
-                            file_name=f"results_{result.timestamp}.csv",
-                            mime="text/csv"
-                        )
-                    
-                    # Add to display messages
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": response_text,
-                        "sql": result.sql,
-                        "data": result.data,
-                        "timestamp": result.timestamp
-                    })
+                        status.write(f"✓ {update.replace('_', ' ')}")
+                status.update(label="LangGraph workflow complete", state="complete", expanded=False)
+            
+            # Update LangGraph message history
+            st.session_state.langgraph_messages.append(HumanMessage(content=prompt))
+            
+            if result.success:
+                row_count = len(result.data)
+                
+                if row_count == 0:
+                    response_text = "I found no results for your query."
+                elif row_count == 1 and len(result.data.columns) == 1:
+                    value = result.data.iloc[0, 0]
+                    response_text = f"**Answer:** {value}"
+                elif result.truncated:
+                    response_text = (
+                        f"Found more than **{MAX_RESULT_ROWS:,}** results, "
+                        f"showing the first {MAX_RESULT_ROWS:,}:"
+                    )
                 else:
-                    error_msg = f" Error: {result.error}"
-                    st.error(error_msg)
-                    st.session_state.langgraph_messages.append(AIMessage(content=error_msg))
-                    
-                    if result.sql:
-                        with st.expander(" Generated SQL"):
-                            st.code(result.sql, language="sql")
+                    response_text = f"Found **{row_count}** results:"
+                
+                st.markdown(response_text)
+                st.session_state.langgraph_messages.append(AIMessage(content=response_text))
+                
+                # Show SQL
+                if result.sql:
+                    with st.expander("SQL Query"):
+                        st.code(result.sql, language="sql")
+                
+                # Show results
+                csv = None
+                if row_count > 0:
+                    st.dataframe(result.data, use_container_width=True)
                     
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": error_msg,
-                        "sql": result.sql,
-                        "timestamp": result.timestamp
-                    })
+                    csv = result.data.to_csv(index=False).encode("utf-8")
+                    st.download_button(
+                        label=" Download CSV",
+                        data=csv,
+                        file_name=f"results_{result.timestamp}.csv",
+                        mime="text/csv"
+                    )
+                
+                # Add to display messages
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": response_text,
+                    "sql": result.sql,
+                    "data": result.data,
+                    "csv": csv,
+                    "timestamp": result.timestamp
+                })
+            else:
+                error_msg = f" Error: {result.error}"
+                st.error(error_msg)
+                st.session_state.langgraph_messages.append(AIMessage(content=error_msg))
+                
+                if result.sql:
+                    with st.expander(" Generated SQL"):
+                        st.code(result.sql, language="sql")
+                
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": error_msg,
+                    "sql": result.sql,
+                    "timestamp": result.timestamp
+                })
 
 # Footer
 st.divider()
@@ -1,15 +1,18 @@
 """
-Database migration script to add session_name column to existing chat_history.db
+Database migration script to add session_name and sql_dialect columns to existing chat_history.db
 
 WHAT THIS DOES:
 - Adds session_name column to chat_sessions table for ChatGPT-style naming
 - Updates existing sessions with default names
+- Adds sql_dialect column to chat_messages (which database a saved query targets;
+  rows without it were written for SQLite)
+- Creates the session/message indexes used by the app
 - Safe to run multiple times (idempotent)
 
 WHEN TO RUN:
 - First time setup
 - After pulling code updates
-- If you see "no such column: session_name" error
+- If you see "no such column: session_name" or "no such column: sql_dialect" error
 
 HOW TO RUN:
     cd final_site
@@ -19,11 +22,22 @@ TECHNICAL DETAILS:
 - Checks if column exists before adding (prevents errors)
 - Uses ALTER TABLE (standard SQL DDL)
 - Auto-generates names from session_id for existing records
-- Commits transaction only on success
+- Runs the whole migration in one transaction, committed only on success
+- Switches the file to WAL journaling (matches the app's connection)
 """
 import sqlite3
 import os
 
+
+def sql_dialect_upgrade(cursor) -> str:
+    """ALTER statement adding chat_messages.sql_dialect, or "" if not needed"""
+    cursor.execute("SELECT name FROM pragma_table_info('chat_messages')")
+    columns = {row[0] for row in cursor.fetchall()}
+    if not columns or 'sql_dialect' in columns:
+        return ""
+    return "ALTER TABLE chat_messages ADD COLUMN sql_dialect TEXT;"
+
+
 def migrate_database():
     db_path = "chat_history.db"
     
@@ -34,30 +48,64 @@ def migrate_database():
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
+    # WAL persists on the file, so the app's connections inherit it
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")
+    
     try:
         # Check if session_name column already exists
-        cursor.execute("PRAGMA table_info(chat_sessions)")
-        columns = [col[1] for col in cursor.fetchall()]
+        cursor.execute("""
+            SELECT 1 FROM pragma_table_info('chat_sessions')
+            WHERE name = 'session_name'
+        """)
+        has_session_name = cursor.fetchone() is not None
         
-        if 'session_name' in columns:
+        if has_session_name:
             print("✓ Column 'session_name' already exists. No migration needed.")
+            add_session_name = ""
         else:
             print("Adding 'session_name' column to chat_sessions table...")
-            cursor.execute("""
+            # Add the column and give existing sessions default names
+            add_session_name = """
                 ALTER TABLE chat_sessions 
-                ADD COLUMN session_name TEXT
-            """)
-            
-            # Update existing sessions with default names
-            cursor.execute("""
+                ADD COLUMN session_name TEXT;
+                
                 UPDATE chat_sessions 
                 SET session_name = 'Conversation ' || substr(session_id, 1, 8)
-                WHERE session_name IS NULL
-            """)
+                WHERE session_name IS NULL;
+            """
+        
+        add_sql_dialect = sql_dialect_upgrade(cursor)
+        if add_sql_dialect:
+            print("Adding 'sql_dialect' column to chat_messages table...")
+        else:
+            print("✓ Column 'sql_dialect' already exists. No migration needed.")
+        
+        # One transaction for the whole migration. The indexes match the ones
+        # the agent creates on startup, for databases that predate them;
+        # ANALYZE lets the planner pick them up
+        cursor.executescript(f"""
+            BEGIN;
+            {add_session_name}
+            {add_sql_dialect}
+            CREATE INDEX IF NOT EXISTS idx_msgs_session_time
+            ON chat_messages(session_id, timestamp);
             
-            conn.commit()
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_activity
+            ON chat_sessions(last_activity DESC);
+            
+            ANALYZE;
+            COMMIT;
+        """)
+        
+        if not has_session_name:
             print("✓ Migration completed successfully!")
             print("✓ Updated existing sessions with default names.")
+        if add_sql_dialect:
+            print("✓ Added 'sql_dialect' column to chat_messages.")
+        print("✓ Chat history indexes in place.")
             
     except Exception as e:
         print(f"✗ Migration failed: {e}")